@@ -1,12 +1,47 @@
 """
 California Circuity Factor API - FastAPI Application
 """
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import uvicorn
 
-from app.database import create_tables, test_connection
+from app.database import AsyncSessionLocal, create_tables, test_connection
 from app.routers import circuity
+from app.services.cache_service import CacheService
+from app.services.distance_service import DistanceService
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize database tables and shared clients on startup"""
+    print("🚀 Starting California Circuity Factor API...")
+    print("📊 Creating database tables...")
+    await create_tables()
+    async with AsyncSessionLocal() as db:
+        backfilled = await CacheService.backfill_cache_keys(db)
+    if backfilled:
+        print(f"🔑 Backfilled cache keys for {backfilled} calculations")
+    
+    # Test connections
+    db_connected = await test_connection()
+    print(f"🗄️  Database: {'Connected' if db_connected else 'Failed'}")
+    
+    # Shared OSRM client, reused by every request through app.state
+    app.state.distance_service = DistanceService()
+    await app.state.distance_service.start()
+    osrm_connected = await app.state.distance_service.test_osrm_connection()
+    print(f"🗺️  OSRM: {'Connected' if osrm_connected else 'Failed'}")
+    
+    if db_connected and osrm_connected:
+        print("All services ready!")
+    else:
+        print("Some services are not available")
+    
+    yield
+    
+    await app.state.distance_service.close()
 
 # Create FastAPI app
 app = FastAPI(
@@ -14,7 +49,9 @@ app = FastAPI(
     description="Calculate transportation efficiency using circuity factors",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -29,27 +66,6 @@ app.add_middleware(
 # Include routers
 app.include_router(circuity.router, tags=["circuity"])
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database tables on startup"""
-    print("🚀 Starting California Circuity Factor API...")
-    print("📊 Creating database tables...")
-    create_tables()
-    
-    # Test connections
-    db_connected = test_connection()
-    print(f"🗄️  Database: {'Connected' if db_connected else 'Failed'}")
-    
-    from app.services.distance_service import DistanceService
-    distance_service = DistanceService()
-    osrm_connected = distance_service.test_osrm_connection()
-    print(f"🗺️  OSRM: {'Connected' if osrm_connected else 'Failed'}")
-    
-    if db_connected and osrm_connected:
-        print("All services ready!")
-    else:
-        print("Some services are not available")
-
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -62,10 +78,19 @@ async def root():
         "endpoints": {
             "calculate": "POST /calculate - Calculate circuity between two points",
             "history": "GET /history - Get calculation history", 
+            "history_paginated": "GET /history/paginated - Get calculation history page by page",
             "stats": "GET /stats - Get calculation statistics",
             "health": "GET /health - Service health check"
         }
     }
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Explicit loop/http so a missing uvloop or httptools fails loudly instead of falling back
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "4"))
+    )
\ No newline at end of file
@@ -1,14 +1,21 @@
 """
 Pydantic models for request/response validation
 """
-from pydantic import BaseModel, Field, validator
-from typing import Optional, Literal
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import List, Optional, Literal
 from datetime import datetime
 
 class Coordinates(BaseModel):
     """Basic coordinate validation"""
     lat: float = Field(..., ge=-90, le=90, description="Latitude between -90 and 90")
     lng: float = Field(..., ge=-180, le=180, description="Longitude between -180 and 180")
+    
+    @field_validator("lat", "lng", mode="after")
+    @classmethod
+    def round_coordinate(cls, v: float) -> float:
+        """Canonicalize to 6 decimal places so downstream cache code can use values as-is"""
+        # + 0.0 turns -0.0 into 0.0 so both hash to the same cache key
+        return round(v, 6) + 0.0
 
 class Location(Coordinates):
     """Location with optional name"""
@@ -19,15 +26,6 @@ class CircuityRequest(BaseModel):
     origin: Location
     destination: Location
     units: Literal["miles", "km"] = Field(default="miles", description="Distance units")
-    
-    @validator('origin', 'destination')
-    def validate_coordinates(cls, v):
-        """Ensure coordinates are valid numbers"""
-        if not (-90 <= v.lat <= 90):
-            raise ValueError('Latitude must be between -90 and 90')
-        if not (-180 <= v.lng <= 180):
-            raise ValueError('Longitude must be between -180 and 180')
-        return v
 
 class CircuityResponse(BaseModel):
     """Response model for circuity calculation"""
@@ -50,6 +48,8 @@ class HealthResponse(BaseModel):
 
 class HistoryResponse(BaseModel):
     """Historical calculation response"""
+    model_config = ConfigDict(from_attributes=True)
+    
     id: int
     origin_lat: float
     origin_lng: float
@@ -62,4 +62,12 @@ class HistoryResponse(BaseModel):
     circuity_factor: float
     units: str
     created_at: datetime
-    calculation_time_ms: int
\ No newline at end of file
+    calculation_time_ms: int
+
+class PaginatedHistoryResponse(BaseModel):
+    """Page of historical calculations"""
+    items: List[HistoryResponse]
+    total: Optional[int] = Field(None, description="Total number of stored calculations (page mode only)")
+    page: Optional[int] = Field(None, description="Page number (page mode only)")
+    limit: int
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page, null on the last page")
\ No newline at end of file
@@ -1,37 +1,45 @@
 """
 API endpoints for circuity calculations
 """
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+import asyncio
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from app.database import get_db, test_connection
-from app.models import CircuityRequest, CircuityResponse, HealthResponse, HistoryResponse
+from app.database import get_db, release_session, test_connection
+from app.models import CircuityRequest, CircuityResponse, HealthResponse, HistoryResponse, PaginatedHistoryResponse
 from app.services.distance_service import DistanceService
 from app.services.cache_service import CacheService
 from datetime import datetime
 
 router = APIRouter()
-distance_service = DistanceService()
+
+def get_distance_service(request: Request) -> DistanceService:
+    """Shared DistanceService created in the application lifespan"""
+    return request.app.state.distance_service
 
 @router.post("/calculate", response_model=CircuityResponse)
 async def calculate_circuity(
     request: CircuityRequest,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    distance_service: DistanceService = Depends(get_distance_service)
 ):
     """
     Calculate circuity factor between two locations.
     
-    Checks cache first, calculates if not found, then stores result.
+    Checks cache first, calculates if not found, then stores result
+    in the background after the response is sent.
     """
     try:
         # Check cache first
-        cached_result = CacheService.get_cached_calculation(db, request)
+        cached_result = await CacheService.get_cached_calculation(db, request)
+        await release_session(db)
         if cached_result:
             return cached_result
         
         # Calculate new result
-        road_dist, straight_dist, circuity_factor, efficiency, calc_time = distance_service.calculate_circuity(
+        road_dist, straight_dist, circuity_factor, efficiency, calc_time = await distance_service.calculate_circuity(
             request.origin.lat, request.origin.lng,
             request.destination.lat, request.destination.lng,
             request.units
@@ -50,8 +58,8 @@ async def calculate_circuity(
             cached=False
         )
         
-        # Save to cache
-        CacheService.save_calculation(db, request, response)
+        # Save to cache off the request path
+        background_tasks.add_task(CacheService.save_calculation, request, response)
         
         return response
         
@@ -64,32 +72,61 @@ async def calculate_circuity(
 @router.get("/history", response_model=List[HistoryResponse])
 async def get_calculation_history(
     limit: int = 50,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get recent calculation history
     """
     try:
-        calculations = CacheService.get_calculation_history(db, limit)
+        calculations = await CacheService.get_calculation_history(db, limit)
+        await release_session(db)
+        
+        # HistoryResponse reads ORM attributes directly via from_attributes
+        return calculations
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve history: {str(e)}"
+        )
+
+@router.get("/history/paginated", response_model=PaginatedHistoryResponse)
+async def get_calculation_history_paginated(
+    cursor: Optional[str] = None,
+    page: Optional[int] = Query(None, ge=1, description="Legacy offset pagination; prefer cursor"),
+    limit: int = Query(50, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get calculation history one page at a time
+    
+    Pass the returned next_cursor to fetch the following page.
+    """
+    after = None
+    if cursor:
+        try:
+            after = CacheService.decode_history_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    try:
+        if page is not None and not cursor:
+            calculations, total = await CacheService.get_calculation_history_paginated(db, page, limit)
+            next_cursor = None
+            if calculations and page * limit < total:
+                next_cursor = CacheService.encode_history_cursor(calculations[-1])
+        else:
+            calculations, next_cursor = await CacheService.get_calculation_history_after(db, after, limit)
+            total = None
+        await release_session(db)
         
-        return [
-            HistoryResponse(
-                id=calc.id,
-                origin_lat=calc.origin_lat,
-                origin_lng=calc.origin_lng,
-                origin_name=calc.origin_name,
-                destination_lat=calc.destination_lat,
-                destination_lng=calc.destination_lng,
-                destination_name=calc.destination_name,
-                road_distance=calc.road_distance,
-                straight_distance=calc.straight_distance,
-                circuity_factor=calc.circuity_factor,
-                units=calc.units,
-                created_at=calc.created_at,
-                calculation_time_ms=calc.calculation_time_ms
-            )
-            for calc in calculations
-        ]
+        return PaginatedHistoryResponse(
+            items=calculations,
+            total=total,
+            page=page if not cursor else None,
+            limit=limit,
+            next_cursor=next_cursor
+        )
         
     except Exception as e:
         raise HTTPException(
@@ -98,12 +135,13 @@ async def get_calculation_history(
         )
 
 @router.get("/stats")
-async def get_calculation_stats(db: Session = Depends(get_db)):
+async def get_calculation_stats(db: AsyncSession = Depends(get_db)):
     """
     Get calculation statistics
     """
     try:
-        stats = CacheService.get_calculation_stats(db)
+        stats = await CacheService.get_calculation_stats(db)
+        await release_session(db)
         return stats
     except Exception as e:
         raise HTTPException(
@@ -112,12 +150,17 @@ async def get_calculation_stats(db: Session = Depends(get_db)):
         )
 
 @router.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(distance_service: DistanceService = Depends(get_distance_service)):
     """
     Check health of services (OSRM and Database)
     """
-    osrm_status = distance_service.test_osrm_connection()
-    db_status = test_connection()
+    # Probe both services concurrently; an unexpected exception counts as unavailable
+    results = await asyncio.gather(
+        distance_service.test_osrm_connection(),
+        test_connection(),
+        return_exceptions=True
+    )
+    osrm_status, db_status = (result is True for result in results)
     
     status_code = status.HTTP_200_OK
     if not osrm_status or not db_status:
@@ -1,72 +1,99 @@
 """
 Database caching service for storing and retrieving calculations
 """
-from sqlalchemy.orm import Session
-from app.database import CircuityCalculation
+import base64
+import hashlib
+import os
+from datetime import datetime
+from cachetools import TTLCache
+from sqlalchemy import lambda_stmt, select, update, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, CircuityCalculation
 from app.models import CircuityRequest, CircuityResponse, Location
-from typing import Optional, List
+from typing import Optional, List, Tuple
+
+# In-process cache in front of PostgreSQL for hot origin/destination pairs, keyed by cache_key.
+# Accessed only from the event loop thread with no awaits between check and set, so no lock is needed.
+_mem_cache: TTLCache = TTLCache(
+    maxsize=int(os.getenv("MEMORY_CACHE_SIZE", "10000")),
+    ttl=int(os.getenv("MEMORY_CACHE_TTL", "3600"))
+)
 
 class CacheService:
     
     @staticmethod
-    def _create_cache_key(lat1: float, lng1: float, lat2: float, lng2: float, units: str) -> str:
+    def _create_cache_key(lat1: float, lng1: float, lat2: float, lng2: float, units: str) -> int:
         """
         Create a cache key from coordinates and units
-        Round coordinates to 6 decimal places for reasonable precision
+        Coordinates are expected pre-rounded to 6 decimal places (see Coordinates). Endpoints are
+        ordered so A->B and B->A share a key. Returns a signed 63-bit integer for BIGINT storage.
         """
-        lat1_rounded = round(lat1, 6)
-        lng1_rounded = round(lng1, 6) 
-        lat2_rounded = round(lat2, 6)
-        lng2_rounded = round(lng2, 6)
-        return f"{lat1_rounded},{lng1_rounded}|{lat2_rounded},{lng2_rounded}|{units}"
+        lo, hi = sorted(((lat1, lng1), (lat2, lng2)))
+        digest = hashlib.blake2b(f"{lo}|{hi}|{units}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") & 0x7FFFFFFFFFFFFFFF
     
     @staticmethod
-    def get_cached_calculation(db: Session, request: CircuityRequest) -> Optional[CircuityResponse]:
-        # Check both directions (A->B and B->A should give same result)
-        calc = db.query(CircuityCalculation).filter(
-            CircuityCalculation.origin_lat == round(request.origin.lat, 6),
-            CircuityCalculation.origin_lng == round(request.origin.lng, 6),
-            CircuityCalculation.destination_lat == round(request.destination.lat, 6),
-            CircuityCalculation.destination_lng == round(request.destination.lng, 6),
-            CircuityCalculation.units == request.units
-        ).first()
-        
-        if not calc:
-            # Try reverse direction
-            calc = db.query(CircuityCalculation).filter(
-                CircuityCalculation.origin_lat == round(request.destination.lat, 6),
-                CircuityCalculation.origin_lng == round(request.destination.lng, 6),
-                CircuityCalculation.destination_lat == round(request.origin.lat, 6),
-                CircuityCalculation.destination_lng == round(request.origin.lng, 6),
-                CircuityCalculation.units == request.units
-            ).first()
+    def _cache_entry(calc) -> dict:
+        """
+        Extract the stored result fields shared by a calculation row or response
+        """
+        return {
+            "road_distance": calc.road_distance,
+            "straight_distance": calc.straight_distance,
+            "circuity_factor": calc.circuity_factor,
+            "efficiency_percent": calc.efficiency_percent,
+            "units": calc.units,
+            "calculation_time_ms": calc.calculation_time_ms
+        }
+    
+    @staticmethod
+    async def get_cached_calculation(db: AsyncSession, request: CircuityRequest) -> Optional[CircuityResponse]:
+        # Key is orientation-independent (A->B and B->A should give same result)
+        cache_key = CacheService._create_cache_key(
+            request.origin.lat, request.origin.lng,
+            request.destination.lat, request.destination.lng,
+            request.units
+        )
+        result = _mem_cache.get(cache_key)
         
-        if calc:
-            return CircuityResponse(
-                origin=request.origin,
-                destination=request.destination,
-                road_distance=calc.road_distance,
-                straight_distance=calc.straight_distance,
-                circuity_factor=calc.circuity_factor,
-                efficiency_percent=calc.efficiency_percent,
-                units=calc.units,
-                calculation_time_ms=calc.calculation_time_ms,
-                cached=True
-            )
+        if result is None:
+            # lambda_stmt caches the constructed and compiled SQL by code location; cache_key is bound per call
+            calc = await db.scalar(lambda_stmt(
+                lambda: select(CircuityCalculation).where(CircuityCalculation.cache_key == cache_key).limit(1)
+            ))
+            if not calc:
+                return None
+            
+            result = CacheService._cache_entry(calc)
+            _mem_cache[cache_key] = result
         
-        return None
+        return CircuityResponse(
+            origin=request.origin,
+            destination=request.destination,
+            cached=True,
+            **result
+        )
     
     @staticmethod
-    def save_calculation(db: Session, request: CircuityRequest, response: CircuityResponse) -> None:
+    async def save_calculation(request: CircuityRequest, response: CircuityResponse) -> None:
         """
         Save calculation to database
+        Runs as a background task after the response is sent, on its own short-lived session
         """
+        cache_key = CacheService._create_cache_key(
+            request.origin.lat, request.origin.lng,
+            request.destination.lat, request.destination.lng,
+            request.units
+        )
+        _mem_cache[cache_key] = CacheService._cache_entry(response)
+        
         calc = CircuityCalculation(
-            origin_lat=round(request.origin.lat, 6),
-            origin_lng=round(request.origin.lng, 6),
+            cache_key=cache_key,
+            origin_lat=request.origin.lat,
+            origin_lng=request.origin.lng,
             origin_name=request.origin.name,
-            destination_lat=round(request.destination.lat, 6),
-            destination_lng=round(request.destination.lng, 6),
+            destination_lat=request.destination.lat,
+            destination_lng=request.destination.lng,
             destination_name=request.destination.name,
             road_distance=response.road_distance,
             straight_distance=response.straight_distance,
@@ -76,25 +103,136 @@ class CacheService:
             calculation_time_ms=response.calculation_time_ms
         )
         
-        db.add(calc)
-        db.commit()
+        try:
+            async with AsyncSessionLocal() as db:
+                db.add(calc)
+                await db.commit()
+        except Exception as e:
+            print(f"Failed to save calculation: {e}")
     
     @staticmethod
-    def get_calculation_history(db: Session, limit: int = 50) -> List[CircuityCalculation]:
+    async def backfill_cache_keys(db: AsyncSession) -> int:
+        """
+        Populate cache_key for rows stored before the column existed
+        """
+        result = await db.execute(
+            select(
+                CircuityCalculation.id,
+                CircuityCalculation.origin_lat,
+                CircuityCalculation.origin_lng,
+                CircuityCalculation.destination_lat,
+                CircuityCalculation.destination_lng,
+                CircuityCalculation.units
+            ).where(CircuityCalculation.cache_key.is_(None))
+        )
+        rows = result.all()
+        
+        if rows:
+            # ORM bulk UPDATE by primary key, sent as a single executemany
+            await db.execute(update(CircuityCalculation), [
+                {
+                    "id": row.id,
+                    "cache_key": CacheService._create_cache_key(
+                        row.origin_lat, row.origin_lng,
+                        row.destination_lat, row.destination_lng,
+                        row.units
+                    )
+                }
+                for row in rows
+            ])
+        
+        await db.commit()
+        return len(rows)
+    
+    @staticmethod
+    async def get_calculation_history(db: AsyncSession, limit: int = 50) -> List[CircuityCalculation]:
         """
         Get recent calculation history
         """
-        return db.query(CircuityCalculation)\
-                 .order_by(CircuityCalculation.created_at.desc())\
-                 .limit(limit)\
-                 .all()
+        result = await db.scalars(
+            select(CircuityCalculation)
+            .order_by(CircuityCalculation.created_at.desc())
+            .limit(limit)
+        )
+        return list(result.all())
+    
+    @staticmethod
+    async def get_calculation_history_paginated(db: AsyncSession, page: int = 1, limit: int = 50) -> Tuple[List[CircuityCalculation], int]:
+        """
+        Get one page of calculation history along with the total row count
+        The total comes from a window function so the page and count share one query
+        """
+        result = await db.execute(
+            select(CircuityCalculation, func.count().over().label("total"))
+            .order_by(CircuityCalculation.created_at.desc(), CircuityCalculation.id.desc())
+            .limit(limit)
+            .offset((page - 1) * limit)
+        )
+        rows = result.all()
+        
+        if rows:
+            return [row[0] for row in rows], rows[0].total
+        
+        # Past the last page there are no rows to carry the window count
+        total = await db.scalar(select(func.count()).select_from(CircuityCalculation)) if page > 1 else 0
+        return [], total
+    
+    @staticmethod
+    def encode_history_cursor(calc: CircuityCalculation) -> str:
+        """
+        Encode a history row's (created_at, id) position as an opaque cursor
+        """
+        return base64.urlsafe_b64encode(f"{calc.created_at.isoformat()}|{calc.id}".encode()).decode()
+    
+    @staticmethod
+    def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+        """
+        Decode a cursor produced by encode_history_cursor
+        Raises ValueError for malformed cursors
+        """
+        try:
+            created_at, calc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(created_at), int(calc_id)
+        except Exception:
+            raise ValueError("Invalid history cursor")
     
     @staticmethod
-    def get_calculation_stats(db: Session) -> dict:
+    async def get_calculation_history_after(db: AsyncSession, after: Optional[Tuple[datetime, int]], limit: int = 50) -> Tuple[List[CircuityCalculation], Optional[str]]:
+        """
+        Get the page of calculation history following a decoded cursor (or the newest page without one)
+        Keyset pagination seeks on (created_at, id), so each page costs the same regardless of depth.
+        Returns the rows and the cursor for the next page, or None on the last page.
+        """
+        stmt = select(CircuityCalculation)
+        if after:
+            stmt = stmt.where(tuple_(CircuityCalculation.created_at, CircuityCalculation.id) < after)
+        
+        # Fetch one extra row to learn whether another page exists
+        result = await db.scalars(
+            stmt.order_by(CircuityCalculation.created_at.desc(), CircuityCalculation.id.desc())
+            .limit(limit + 1)
+        )
+        calculations = list(result.all())
+        
+        if len(calculations) > limit:
+            calculations = calculations[:limit]
+            return calculations, CacheService.encode_history_cursor(calculations[-1])
+        
+        return calculations, None
+    
+    @staticmethod
+    async def get_calculation_stats(db: AsyncSession) -> dict:
         """
         Get basic statistics about calculations
         """
-        total_calculations = db.query(CircuityCalculation).count()
+        row = (await db.execute(
+            select(
+                func.count(),
+                func.avg(CircuityCalculation.circuity_factor),
+                func.avg(CircuityCalculation.efficiency_percent)
+            ).select_from(CircuityCalculation)
+        )).one()
+        total_calculations, avg_circuity, avg_efficiency = row
         
         if total_calculations == 0:
             return {
@@ -103,15 +241,6 @@ class CacheService:
                 "average_efficiency_percent": 0
             }
         
-        # Calculate averages
-        avg_circuity = db.query(
-            db.func.avg(CircuityCalculation.circuity_factor)
-        ).scalar()
-        
-        avg_efficiency = db.query(
-            db.func.avg(CircuityCalculation.efficiency_percent)
-        ).scalar()
-        
         return {
             "total_calculations": total_calculations,
             "average_circuity_factor": round(float(avg_circuity or 0), 3),
@@ -1,11 +1,15 @@
 """
 Distance calculation service using OSRM and Haversine formula
 """
-import math
+import asyncio
 import time
-import requests
+import httpx
 import os
-from typing import Tuple
+import numpy as np
+import orjson
+from typing import List, Optional, Sequence, Tuple
+
+from app.services._haversine import EARTH_RADIUS_KM, EARTH_RADIUS_MILES, equirectangular, haversine, haversine_np
 
 class DistanceService:
     def __init__(self):
@@ -13,65 +17,171 @@ class DistanceService:
         self.osrm_port = os.getenv("OSRM_PORT", "5001")
         self.osrm_url = f"http://{self.osrm_host}:{self.osrm_port}"
         self.timeout = int(os.getenv("OSRM_TIMEOUT", "10"))
+        # osrm-routed rejects table requests above --max-table-size coordinates (default 100)
+        self.table_max_coords = int(os.getenv("OSRM_TABLE_MAX_COORDS", "100"))
+        # Bounds in-flight table requests so large matrices don't queue past the client pool
+        self.table_concurrency = int(os.getenv("OSRM_TABLE_CONCURRENCY", "8"))
+        self._table_semaphore = asyncio.Semaphore(self.table_concurrency)
+        self._client = None
+        
+        # Opt-in equirectangular approximation for nearby points (e.g. California-scoped traffic)
+        self.approx_distance = os.getenv("STRAIGHT_APPROX", "0") == "1"
+        self.approx_max_span = float(os.getenv("STRAIGHT_APPROX_MAX_SPAN", "10"))
+        
+        # Only the route distance is read, so ask OSRM to leave out geometry, steps and annotations
+        self._route_params = {
+            "overview": "false",
+            "alternatives": "false",
+            "steps": "false",
+            "annotations": "false"
+        }
+        # OSRM distances are in meters
+        self._meters_to_units = {"miles": 0.000621371, "km": 0.001}
+    
+    async def start(self) -> None:
+        """
+        Open the shared HTTP client used for all OSRM requests
+        """
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.osrm_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_keepalive_connections=100, max_connections=200)
+            )
+    
+    async def close(self) -> None:
+        """
+        Close the shared HTTP client
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     def calculate_straight_distance(self, lat1: float, lng1: float, lat2: float, lng2: float, units: str = "miles") -> float:
         """
         Calculate straight-line distance using Haversine formula
+        Uses the equirectangular approximation instead when enabled and both spans are within
+        approx_max_span degrees
+        """
+        R = EARTH_RADIUS_MILES if units == "miles" else EARTH_RADIUS_KM
+        if (self.approx_distance
+                and abs(lat2 - lat1) < self.approx_max_span
+                and abs(lng2 - lng1) < self.approx_max_span):
+            return round(equirectangular(lat1, lng1, lat2, lng2, R), 2)
+        return round(haversine(lat1, lng1, lat2, lng2, R), 2)
+    
+    def calculate_straight_distance_batch(self, lat1, lng1, lat2, lng2, units: str = "miles") -> np.ndarray:
+        """
+        Calculate straight-line distances for arrays of coordinate pairs in one vectorized pass
+        """
+        R = EARTH_RADIUS_MILES if units == "miles" else EARTH_RADIUS_KM
+        return np.round(haversine_np(lat1, lng1, lat2, lng2, R), 2)
+    
+    async def calculate_road_distance(self, lat1: float, lng1: float, lat2: float, lng2: float, units: str = "miles") -> float:
+        """
+        Calculate road distance using OSRM
+        """
+        try:
+            response = await self._client.get(f"/route/v1/driving/{lng1},{lat1};{lng2},{lat2}", params=self._route_params)
+            response.raise_for_status()
+            
+            data = orjson.loads(response.content)
+            
+            if data["code"] != "Ok":
+                raise Exception(f"OSRM error: {data.get('message', 'Unknown error')}")
+            
+            routes = data["routes"]
+            if not routes:
+                raise Exception("No routes found")
+            
+            return round(routes[0]["distance"] * self._meters_to_units[units], 2)
+            
+        except httpx.HTTPError as e:
+            raise Exception(f"OSRM connection error: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Road distance calculation failed: {str(e)}")
+    
+    async def calculate_road_distance_matrix(
+        self,
+        origins: Sequence[Tuple[float, float]],
+        destinations: Sequence[Tuple[float, float]],
+        units: str = "miles"
+    ) -> List[List[Optional[float]]]:
         """
-        # Earth's radius
-        R = 3959 if units == "miles" else 6371  # miles or kilometers
+        Calculate road distances from every origin to every destination using the OSRM table service
+        Origins and destinations are (lat, lng) pairs. Returns a len(origins) x len(destinations)
+        matrix, with None where OSRM found no route.
+        """
+        if not origins or not destinations:
+            return [[] for _ in origins]
         
-        # Convert to radians
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        dlat = math.radians(lat2 - lat1)
-        dlng = math.radians(lng2 - lng1)
+        # Split into blocks that fit OSRM's coordinate limit and fetch them concurrently.
+        # A side that fits in half the budget is sent whole and the other side gets the rest.
+        half = max(self.table_max_coords // 2, 1)
+        if len(origins) + len(destinations) <= self.table_max_coords:
+            origin_step, destination_step = len(origins), len(destinations)
+        elif len(origins) <= half:
+            origin_step, destination_step = len(origins), self.table_max_coords - len(origins)
+        elif len(destinations) <= half:
+            origin_step, destination_step = self.table_max_coords - len(destinations), len(destinations)
+        else:
+            origin_step = destination_step = half
         
-        # Haversine formula
-        a = (math.sin(dlat/2) * math.sin(dlat/2) + 
-             math.cos(lat1_rad) * math.cos(lat2_rad) * 
-             math.sin(dlng/2) * math.sin(dlng/2))
+        blocks = [
+            (i, j)
+            for i in range(0, len(origins), origin_step)
+            for j in range(0, len(destinations), destination_step)
+        ]
+        results = await asyncio.gather(*(
+            self._fetch_distance_table(origins[i:i + origin_step], destinations[j:j + destination_step], units)
+            for i, j in blocks
+        ))
         
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        distance = R * c
+        matrix: List[List[Optional[float]]] = [[None] * len(destinations) for _ in origins]
+        for (i, j), block in zip(blocks, results):
+            for row_offset, row in enumerate(block):
+                matrix[i + row_offset][j:j + len(row)] = row
         
-        return round(distance, 2)
+        return matrix
     
-    def calculate_road_distance(self, lat1: float, lng1: float, lat2: float, lng2: float, units: str = "miles") -> float:
+    async def _fetch_distance_table(
+        self,
+        origins: Sequence[Tuple[float, float]],
+        destinations: Sequence[Tuple[float, float]],
+        units: str
+    ) -> List[List[Optional[float]]]:
         """
-        Calculate road distance using OSRM
+        Fetch a single OSRM table block
         """
         try:
-            url = f"{self.osrm_url}/route/v1/driving/{lng1},{lat1};{lng2},{lat2}"
+            coordinates = ";".join(f"{lng},{lat}" for lat, lng in (*origins, *destinations))
             params = {
-                "overview": "false",
-                "alternatives": "false", 
-                "steps": "false"
+                "sources": ";".join(str(i) for i in range(len(origins))),
+                "destinations": ";".join(str(i) for i in range(len(origins), len(origins) + len(destinations))),
+                "annotations": "distance"
             }
             
-            response = requests.get(url, params=params, timeout=self.timeout)
+            async with self._table_semaphore:
+                response = await self._client.get(f"/table/v1/driving/{coordinates}", params=params)
             response.raise_for_status()
             
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get("code") != "Ok":
                 raise Exception(f"OSRM error: {data.get('message', 'Unknown error')}")
             
-            if not data.get("routes"):
-                raise Exception("No routes found")
-            
-            # Distance from OSRM is in meters
-            distance_km = data["routes"][0]["distance"] / 1000
-            distance = distance_km * 0.621371 if units == "miles" else distance_km
+            factor = self._meters_to_units[units]
+            return [
+                [round(d * factor, 2) if d is not None else None for d in row]
+                for row in data["distances"]
+            ]
             
-            return round(distance, 2)
-            
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise Exception(f"OSRM connection error: {str(e)}")
         except Exception as e:
-            raise Exception(f"Road distance calculation failed: {str(e)}")
+            raise Exception(f"Road distance matrix calculation failed: {str(e)}")
     
-    def calculate_circuity(self, lat1: float, lng1: float, lat2: float, lng2: float, units: str = "miles") -> Tuple[float, float, float, float, int]:
+    async def calculate_circuity(self, lat1: float, lng1: float, lat2: float, lng2: float, units: str = "miles") -> Tuple[float, float, float, float, int]:
         """
         Calculate both distances and circuity factor
         Returns: (road_distance, straight_distance, circuity_factor, efficiency_percent, calculation_time_ms)
@@ -80,7 +190,7 @@ class DistanceService:
         
         # Calculate both distances
         straight_distance = self.calculate_straight_distance(lat1, lng1, lat2, lng2, units)
-        road_distance = self.calculate_road_distance(lat1, lng1, lat2, lng2, units)
+        road_distance = await self.calculate_road_distance(lat1, lng1, lat2, lng2, units)
         
         # Calculate metrics
         circuity_factor = round(road_distance / straight_distance, 3)
@@ -90,17 +200,17 @@ class DistanceService:
         
         return road_distance, straight_distance, circuity_factor, efficiency_percent, calculation_time
     
-    def test_osrm_connection(self) -> bool:
+    async def test_osrm_connection(self) -> bool:
         """
         Test OSRM connection with a simple route
         """
         try:
             # Test route: SF to Oakland
-            url = f"{self.osrm_url}/route/v1/driving/-122.4194,37.7749;-122.2711,37.8044"
+            url = "/route/v1/driving/-122.4194,37.7749;-122.2711,37.8044"
             params = {"overview": "false"}
             
-            response = requests.get(url, params=params, timeout=5)
-            return response.status_code == 200 and response.json().get("code") == "Ok"
+            response = await self._client.get(url, params=params, timeout=5)
+            return response.status_code == 200 and orjson.loads(response.content).get("code") == "Ok"
             
         except Exception:
             return False
\ No newline at end of file
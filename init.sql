@@ -5,6 +5,8 @@
 -- Create the circuity_calculations table
 CREATE TABLE IF NOT EXISTS circuity_calculations (
     id SERIAL PRIMARY KEY,
+    -- Orientation-independent hash of rounded coordinates + units
+    cache_key BIGINT NOT NULL,
     -- Origin coordinates
     origin_lat DOUBLE PRECISION NOT NULL,
     origin_lng DOUBLE PRECISION NOT NULL,
@@ -31,20 +33,15 @@ CREATE INDEX IF NOT EXISTS idx_circuity_destination ON circuity_calculations (de
 
 CREATE INDEX IF NOT EXISTS idx_circuity_units ON circuity_calculations (units);
 
-CREATE INDEX IF NOT EXISTS idx_circuity_created_at ON circuity_calculations (created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_circuity_created_at_id ON circuity_calculations (created_at DESC, id DESC);
 
--- Create a composite index for cache lookups
-CREATE INDEX IF NOT EXISTS idx_circuity_cache_lookup ON circuity_calculations (
-    origin_lat,
-    origin_lng,
-    destination_lat,
-    destination_lng,
-    units
-);
+-- Create an index for cache lookups
+CREATE INDEX IF NOT EXISTS idx_circuity_cache_key ON circuity_calculations (cache_key);
 
 -- Insert some sample data for testing (optional)
 INSERT INTO
     circuity_calculations (
+        cache_key,
         origin_lat,
         origin_lng,
         origin_name,
@@ -60,6 +57,7 @@ INSERT INTO
     )
 VALUES
     (
+        108714480285232841,
         37.7749,
         -122.4194,
         'San Francisco',
@@ -74,6 +72,7 @@ VALUES
         245
     ),
     (
+        9063281534991340002,
         36.7378,
         -119.7871,
         'Fresno',
@@ -88,6 +87,7 @@ VALUES
         198
     ),
     (
+        2766056086399485979,
         38.5816,
         -121.4944,
         'Sacramento',